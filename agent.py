@@ -6,81 +6,47 @@ AI Code Mate Agent - GitHub Repository Analysis Assistant
 - Supports dynamic repository switching
 - Streams responses with real-time tool execution
 """
-import os
 import json
-import requests
+import asyncio
+import functools
 import time
-import random
-from dotenv import load_dotenv
-from rich import print
+import httpx
+import orjson
+import tiktoken
 from github_client import GitHubClient
+from semantic_cache import SemanticCache
+from transport import Transport
 import re
-
-load_dotenv()
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
-
-print("API Key present:" + GROQ_API_KEY)
-
+from settings import GROQ_API_KEY, GROQ_MODEL, GROQ_NATIVE_TOOLS
 
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY is required. Please set it in your .env file.")
 
-GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
 HEADERS = {
     "Authorization": f"Bearer {GROQ_API_KEY}",
     "Content-Type": "application/json",
     "Accept": "application/json",
 }
 
-# Shared HTTP helper with retries for Groq API
-def _post_with_retries(payload, stream=False, timeout=300, max_retries=6):
-    attempt = 0
-    last_exc = None
-    while attempt < max_retries:
-        try:
-            r = requests.post(GROQ_URL, headers=HEADERS, json=payload, stream=stream, timeout=timeout)
-            # Handle rate limiting explicitly
-            if r.status_code == 429:
-                # Respect Retry-After header if present
-                retry_after = r.headers.get("Retry-After") or r.headers.get("retry-after") or r.headers.get("X-RateLimit-Reset-After")
-                if retry_after:
-                    try:
-                        sleep_s = float(retry_after)
-                    except ValueError:
-                        # Some providers return a timestamp; fallback to exponential backoff
-                        sleep_s = min(30, (2 ** attempt) + random.uniform(0, 0.5))
-                else:
-                    sleep_s = min(30, (2 ** attempt) + random.uniform(0, 0.5))
-                last_exc = requests.exceptions.HTTPError("429 Too Many Requests", response=r)
-                time.sleep(sleep_s)
-                attempt += 1
-                continue
-            # Retry on some transient 5xx errors as well
-            if 500 <= r.status_code < 600:
-                last_exc = requests.exceptions.HTTPError(f"{r.status_code} Server Error", response=r)
-                sleep_s = min(30, (2 ** attempt) + random.uniform(0, 0.5))
-                time.sleep(sleep_s)
-                attempt += 1
-                continue
-            r.raise_for_status()
-            return r
-        except requests.exceptions.HTTPError as e:
-            # Already handled explicit 429/5xx above; for other HTTP errors do not retry
-            last_exc = e
-            break
-        except requests.exceptions.RequestException as e:
-            # Network-level error; retry with backoff
-            last_exc = e
-            sleep_s = min(30, (2 ** attempt) + random.uniform(0, 0.5))
-            time.sleep(sleep_s)
-            attempt += 1
-            continue
-    if last_exc:
-        raise last_exc
+# One pooled HTTP/2 transport shared by Groq requests and the GitHub client
+transport = Transport(groq_headers=HEADERS)
 
 # Initialize GitHub client
-github_client = GitHubClient()
+github_client = GitHubClient(transport)
+
+# Answers to standalone questions, reused for semantically similar ones (opt-in)
+semantic_cache = SemanticCache()
+
+# Fire-and-forget work (semantic cache writes); referenced here so tasks aren't garbage collected
+_background_tasks = set()
+
+
+def _spawn_background(coro):
+    """Run coro as a task that outlives the caller"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
 SYSTEM_PROMPT = """
 You are AI Code Mate, an expert software engineer and code analyst specializing in GitHub repository analysis.
@@ -121,128 +87,372 @@ USAGE EXAMPLES:
 - To analyze a file: get_file_contents("src/main.py")
 - To explore structure: list_files("src/")
 - To switch repos: switch_repo("owner", "repo-name")
+
+If native function calling is unavailable, reply with a single JSON object instead.
+Batch independent tools into one step; they run in parallel:
+- {"action": "_call_tool", "actions": [{"tool": "list_files", "args": {"path": "src/"}}, {"tool": "get_repo_info", "args": {}}]}
+- {"action": "final_answer", "answer": "..."}
 """
 
+@functools.lru_cache(maxsize=16)
+def _system_prompt_for(repo):
+    """Full system message (persona + tool docs) for a repository"""
+    return SYSTEM_PROMPT.format(current_repo=repo) + "\n" + TOOL_DOCS_TEXT
+
+
+# Native function-calling schema sent with every Groq request (built once at import)
+_TOOL_SCHEMA = (
+    {
+        "type": "function",
+        "function": {
+            "name": "search_code",
+            "description": "Search for code patterns, functions, or text in the repository",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string"},
+                    "path": {"type": "string"}
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_file_contents",
+            "description": "Read the complete contents of a specific file",
+            "parameters": {
+                "type": "object",
+                "properties": {"path": {"type": "string"}},
+                "required": ["path"],
+            },
+        },
+    },
+)
+
+# The schema serialized once; embedded as-is in request bodies instead of re-encoding it per call
+_TOOLS_FRAGMENT = orjson.Fragment(orjson.dumps(_TOOL_SCHEMA))
 
-def _groq_chat_stream(messages, temperature=0.0, max_tokens=1024):
+
+# Query normalization patterns for search_code
+_WS_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[^\w\.\-/ ]")
+
+# Conversation limits for one agent run: tool results are cut to a token budget, and
+# past the char budget older turns are summarized (prompt size grows linearly, not quadratically)
+TOOL_RESULT_MAX_TOKENS = 512
+HISTORY_CHAR_BUDGET = 24000
+HISTORY_KEEP_LAST = 4
+
+# Shared decoder for pulling JSON tool calls out of model text
+_DECODER = json.JSONDecoder()
+
+
+def _extract_json_object(text):
+    """
+    Return the first JSON object embedded in text (surrounding prose is ignored), or None.
+    raw_decode stops at the end of the object, so trailing text and later objects are never parsed.
+    """
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = _DECODER.raw_decode(text, start)
+            if isinstance(obj, dict):
+                return obj
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+
+def _assemble_tool_call(slot):
+    """Build an OpenAI-style tool call from accumulated stream deltas"""
+    return {
+        "id": slot["id"],
+        "type": "function",
+        "function": {"name": slot["name"], "arguments": "".join(slot["args_parts"])},
+    }
+
+
+async def _groq_chat_stream(messages, temperature=0.0, max_tokens=1024):
     """
     Streaming generator: yields text chunks as they arrive.
-    Yields only content deltas (strings). When finished, returns the full message.
+    Yields content deltas (strings). Each native tool call is yielded as
+    {"__tool_call__": tc} as soon as its arguments are complete (the next call index
+    started or a finish_reason arrived), so it can run while the model keeps decoding.
+    When finished, yields a sentinel dict with the full message under "__final__" and
+    all native tool calls under "__tool_calls__".
+    With GROQ_NATIVE_TOOLS off the step is constrained to the agent_step schema; Groq does not
+    stream structured outputs, so that request is non-streaming and only the sentinel is yielded.
     """
     payload = {
         "model": GROQ_MODEL,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
+    }
+    if not GROQ_NATIVE_TOOLS:
+        payload["response_format"] = _AGENT_STEP_FORMAT
+        data = await transport.groq_post(payload, timeout=300)
+        content = data["choices"][0]["message"].get("content") or ""
+        yield {"__final__": content, "__tool_calls__": []}
+        return
+    payload.update({
         "stream": True,
         "tool_choice": "auto",
-        "tools": [
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_code",
-                    "description": "Search for code patterns, functions, or text in the repository",
-                    "parameters": {
+        "parallel_tool_calls": True,
+        "response_format": {"type": "text"},
+        "tools": _TOOLS_FRAGMENT,
+    })
+    body = orjson.dumps(payload)
+    async with transport.groq_stream(body, timeout=300) as r:
+        full = []
+        # Native tool calls arrive as deltas keyed by index; argument fragments are
+        # collected in a list and joined once per call (no quadratic string concatenation)
+        tc_acc = {}
+        # index -> finished OpenAI-style tool call
+        completed = {}
+        # Raw SSE bytes are buffered and split on the blank line that ends each event
+        buf = bytearray()
+        done = False
+        async for raw in r.aiter_bytes(8192):
+            buf += raw
+            idx = buf.find(b"\n\n")
+            while idx != -1:
+                event = buf[:idx]
+                del buf[:idx + 2]
+                idx = buf.find(b"\n\n")
+                if not event.startswith(b"data: "):
+                    continue
+                data = event[6:]
+                if data.strip() == b"[DONE]":
+                    done = True
+                    break
+                try:
+                    obj = orjson.loads(data)
+                    # OpenAI-compatible delta
+                    choices = obj.get("choices", [])
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta", {})
+                    for tc in delta.get("tool_calls") or []:
+                        slot = tc_acc.setdefault(tc.get("index", 0), {"id": None, "name": None, "args_parts": []})
+                        if tc.get("id"):
+                            slot["id"] = tc["id"]
+                        func = tc.get("function") or {}
+                        if func.get("name"):
+                            slot["name"] = func["name"]
+                        if func.get("arguments"):
+                            slot["args_parts"].append(func["arguments"])
+                    chunk = delta.get("content")
+                    if chunk:
+                        full.append(chunk)
+                        yield chunk  # stream out the chunk
+                    # Indices only grow, so every call below the latest one is complete
+                    if tc_acc:
+                        finished = choices[0].get("finish_reason") is not None
+                        last = max(tc_acc)
+                        for i in sorted(tc_acc):
+                            if i not in completed and (i < last or finished):
+                                completed[i] = _assemble_tool_call(tc_acc[i])
+                                yield {"__tool_call__": completed[i]}
+                except Exception:
+                    # if any parsing issue, skip that event
+                    continue
+            if done:
+                break
+        # return final full message as a joined string, plus any tool calls
+        tool_calls = [completed.get(i) or _assemble_tool_call(tc_acc[i]) for i in sorted(tc_acc)]
+        yield {"__final__": "".join(full), "__tool_calls__": tool_calls}
+
+
+# GitHub tool calling functions
+async def _tool_search_code(client, args):
+    query = args.get("query", "")
+    path = args.get("path", "")
+    result = await client.search_code(query, path)
+    return {
+        "query": query,
+        "path": path,
+        "total_matches": result.get("total_count", 0),
+        "filename_matches": result.get("filename_matches", []),
+        "content_matches": result.get("content_matches", {}).get("items", []),
+    }
+
+
+async def _tool_get_file_contents(client, args):
+    path = args.get("path", "")
+    return {"path": path, "content": await client.get_file_contents(path)}
+
+
+async def _tool_list_files(client, args):
+    path = args.get("path", ".")
+    return {"path": path, "files": await client.list_files(path)}
+
+
+async def _tool_get_repo_info(client, args):
+    return {"repo_info": await client.get_repo_info()}
+
+
+async def _tool_switch_repo(client, args):
+    owner = args.get("owner", "")
+    repo = args.get("repo", "")
+    result = client.switch_repo(owner, repo)
+    return {"message": result, "new_repo": f"{owner}/{repo}"}
+
+
+async def _tool_list_all_files(client, args):
+    files = await client.list_all_files()
+    return {"files": files, "count": len(files)}
+
+
+# Tool name -> async handler(client, args); client is the run's GitHubClient
+_TOOL_DISPATCH = {
+    "search_code": _tool_search_code,
+    "get_file_contents": _tool_get_file_contents,
+    "list_files": _tool_list_files,
+    "get_repo_info": _tool_get_repo_info,
+    "switch_repo": _tool_switch_repo,
+    "list_all_files": _tool_list_all_files,
+}
+
+# Structured output used when native tool calls are disabled: every reply is one agent_step
+# object, so it parses directly. Not strict, since tool args are free-form objects.
+_AGENT_STEP_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "agent_step",
+        "strict": False,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "action": {"enum": ["_call_tool", "final_answer"]},
+                "actions": {
+                    "type": "array",
+                    "items": {
                         "type": "object",
                         "properties": {
-                            "query": {"type": "string"},
-                            "path": {"type": "string"}
+                            "tool": {"enum": list(_TOOL_DISPATCH)},
+                            "args": {"type": "object"},
                         },
-                        "required": ["query"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_file_contents",
-                    "description": "Read the complete contents of a specific file",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {"path": {"type": "string"}},
-                        "required": ["path"],
+                        "required": ["tool", "args"],
                     },
                 },
+                "answer": {"type": "string"},
             },
-        ],
-        "response_format": {"type": "text"},
-    }
-    with _post_with_retries(payload, stream=True, timeout=300) as r:
-        r.raise_for_status()
-        # Ensure UTF-8 decoding for streamed chunks to avoid mojibake (e.g., ð)
-        r.encoding = "utf-8"
-        full = []
-        for line in r.iter_lines(decode_unicode=True):
-            if not line:
-                continue
-            if not line.startswith("data: "):
-                continue
-            data = line[6:]
-            if data.strip() == "[DONE]":
-                break
-            try:
-                obj = json.loads(data)
-                # OpenAI-compatible delta
-                choices = obj.get("choices", [])
-                if not choices:
-                    continue
-                delta = choices[0].get("delta", {})
-                chunk = delta.get("content")
-                if chunk:
-                    full.append(chunk)
-                    yield chunk  # stream out the chunk
-            except Exception:
-                # if any parsing issue, skip that line
-                continue
-        # return final full message as a joined string
-        yield {"__final__": "".join(full)}
-# GitHub tool calling functions
-def _call_tool(tool_name, args):
-    """Call GitHub tools using the GitHub client"""
-    try:
-        if tool_name == "search_code":
-            query = args.get("query", "")
-            path = args.get("path", "")
-            result = github_client.search_code(query, path)
-            return {
-                "query": query,
-                "path": path,
-                "total_matches": result.get("total_count", 0),
-                "filename_matches": result.get("filename_matches", []),
-                "content_matches": result.get("content_matches", {}).get("items", []),
-            }
-
-        elif tool_name == "get_file_contents":
-            path = args.get("path", "")
-            content = github_client.get_file_contents(path)
-            return {"path": path, "content": content}
-
-        elif tool_name == "list_files":
-            path = args.get("path", ".")
-            files = github_client.list_files(path)
-            return {"path": path, "files": files}
-
-        elif tool_name == "get_repo_info":
-            info = github_client.get_repo_info()
-            return {"repo_info": info}
-
-        elif tool_name == "switch_repo":
-            owner = args.get("owner", "")
-            repo = args.get("repo", "")
-            result = github_client.switch_repo(owner, repo)
-            return {"message": result, "new_repo": f"{owner}/{repo}"}
-
-        elif tool_name == "list_all_files":
-            files = github_client.list_all_files()
-            return {"files": files, "count": len(files)}
+            "required": ["action"],
+        },
+    },
+}
 
-        else:
-            raise ValueError(f"Unknown tool: {tool_name}")
 
+async def _call_tool(client, tool_name, args):
+    """Call GitHub tools using the run's GitHub client"""
+    fn = _TOOL_DISPATCH.get(tool_name)
+    if fn is None:
+        return {"error": f"Unknown tool: {tool_name}"}
+    try:
+        return await fn(client, args)
     except Exception as e:
         return {"error": f"Tool call failed: {str(e)}"}
 
-def ask_agent_stream(user_question, conv_history=None, debug=False, show_raw_tool=False):
+
+def _parse_tool_call(tc):
+    """Extract (tool_name, args) from a native OpenAI-style tool call"""
+    func = tc.get("function", {})
+    tool_name = func.get("name")
+    arg_str = func.get("arguments") or "{}"
+    try:
+        args = json.loads(arg_str) if isinstance(arg_str, str) else arg_str
+    except Exception:
+        args = {}
+    return tool_name, args
+
+
+# cl100k_base tokenizer, set once loaded. tiktoken downloads it on first use, so it is
+# loaded in a worker thread; a failed load is retried after TOKENIZER_RETRY_SECONDS
+_token_encoding = None
+_token_encoding_retry_at = 0.0
+TOKENIZER_RETRY_SECONDS = 60
+
+
+async def _load_token_encoding():
+    """Load the tokenizer without blocking the event loop; failures are not cached"""
+    global _token_encoding, _token_encoding_retry_at
+    if _token_encoding is not None or time.monotonic() < _token_encoding_retry_at:
+        return
+    try:
+        _token_encoding = await asyncio.to_thread(tiktoken.get_encoding, "cl100k_base")
+    except Exception:
+        _token_encoding_retry_at = time.monotonic() + TOKENIZER_RETRY_SECONDS
+
+
+def _truncate_tokens(text, max_tokens=TOOL_RESULT_MAX_TOKENS):
+    """Cut text to at most max_tokens tokens (about 4 chars per token without a tokenizer)"""
+    enc = _token_encoding
+    if enc is None:
+        return text[:max_tokens * 4]
+    # Tokens are far shorter than 16 chars on average; avoids tokenizing huge payloads
+    window = text[:max_tokens * 16]
+    tokens = enc.encode(window, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return window
+    return enc.decode(tokens[:max_tokens])
+
+
+def _encode_tool_result(result):
+    """Serialize a tool result once; returns (UI preview, token-truncated conversation content)"""
+    encoded = orjson.dumps(result, default=str).decode()
+    preview = encoded[:1200] + ("..." if len(encoded) > 1200 else "")
+    return preview, _truncate_tokens(encoded)
+
+
+async def _summarize(messages):
+    """Short model-written summary of earlier conversation turns"""
+    transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in messages)
+    payload = {
+        "model": GROQ_MODEL,
+        "messages": [
+            {"role": "system", "content": "Summarize the findings in these earlier agent turns and tool results. Keep file paths, names and facts needed to continue the analysis."},
+            {"role": "user", "content": transcript[:HISTORY_CHAR_BUDGET]},
+        ],
+        "temperature": 0.0,
+        "max_tokens": 200,
+    }
+    try:
+        data = await transport.groq_post(payload, timeout=60)
+        return data["choices"][0]["message"].get("content") or ""
+    except Exception:
+        return "(summary unavailable)"
+
+
+async def _compact_history(messages, question_idx):
+    """
+    Once the conversation exceeds HISTORY_CHAR_BUDGET, keep only the system prompt, the user's
+    question and the last few messages, replacing everything else with one summary message.
+    Mutates messages and returns the (new) index of the question.
+    """
+    if sum(len(m.get("content") or "") for m in messages) <= HISTORY_CHAR_BUDGET:
+        return question_idx
+    tail_start = max(question_idx + 1, len(messages) - HISTORY_KEEP_LAST)
+    # Never separate tool results from the assistant message that requested them
+    while tail_start > question_idx + 1 and messages[tail_start]["role"] == "tool":
+        tail_start -= 1
+    middle = messages[1:question_idx] + messages[question_idx + 1:tail_start]
+    if not middle:
+        return question_idx
+    summary = await _summarize(middle)
+    messages[:] = [
+        messages[0],
+        messages[question_idx],
+        {"role": "assistant", "content": f"[summary of earlier tool results: {summary}]"},
+        *messages[tail_start:],
+    ]
+    return 1
+
+
+async def ask_agent_stream(user_question, conv_history=None, debug=False, show_raw_tool=False, repo=None):
     """
     Streaming generator of structured events for the UI.
 
@@ -250,148 +460,147 @@ def ask_agent_stream(user_question, conv_history=None, debug=False, show_raw_too
       - {"type":"model_chunk","text": "..."}  # partial tokens
       - {"type":"tool_call","tool": "search_code","args": {...}}
       - {"type":"tool_result","tool": "...","preview":"...","raw":{...}}  # 'raw' included only if show_raw_tool=True
-      - {"type":"final","text":"..."}  # final assistant message (when not a tool call)
+      - {"type":"final","text":"...","repo":"owner/name"}  # final assistant message (when not a tool call); "error": True on failures
+
+    repo ("owner/name", default: github_client's current repository) is the repository this run
+    talks about. The run works on its own client, so switch_repo only affects this run; the final
+    event reports the repository it ended on.
     """
+    if repo is None:
+        repo = github_client.get_current_repo()
+    owner, name = repo.split("/", 1)
+    client = github_client.for_repo(owner, name)
+    # Only standalone questions go through the semantic cache; follow-ups depend on earlier turns
+    use_cache = semantic_cache.enabled and not conv_history
+    if use_cache:
+        cached = await asyncio.to_thread(semantic_cache.lookup, repo, user_question)
+        if cached is not None:
+            yield {"type": "final", "text": cached, "repo": repo}
+            return
+
+    async for event in _run_agent(client, user_question, conv_history, show_raw_tool):
+        if event["type"] == "final":
+            event["repo"] = client.get_current_repo()
+        # Start the store before yielding (consumers usually stop iterating at the final event),
+        # but don't hold the answer back while it embeds
+        if (use_cache and event["type"] == "final" and not event.get("error")
+                and event["repo"] == repo):
+            _spawn_background(asyncio.to_thread(semantic_cache.add, repo, user_question, event["text"]))
+        yield event
+
+
+async def _run_agent(client, user_question, conv_history, show_raw_tool):
+    """The model/tool loop behind ask_agent_stream; tools run against client"""
     messages = conv_history[:] if conv_history else []
     
-    # Format system prompt with current repository
-    current_repo = github_client.get_current_repo()
-    formatted_system_prompt = SYSTEM_PROMPT.format(current_repo=current_repo)
-    
-    messages.insert(0, {"role": "system", "content": formatted_system_prompt + "\n" + TOOL_DOCS_TEXT})
+    # System prompt for the current repository (formatted once per repo)
+    messages.insert(0, {"role": "system", "content": _system_prompt_for(client.get_current_repo())})
     messages.append({"role": "user", "content": user_question})
+    question_idx = len(messages) - 1
 
     while True:
         # 1) stream a single assistant message
         assembled = []
+        tool_calls = []
+        # Tool call id -> task, started while the model is still streaming
+        pending = {}
         try:
-            for piece in _groq_chat_stream(messages):
-                if isinstance(piece, dict) and "__final__" in piece:
+            final_msg = None
+            # Consume the generator fully so its connection is released on exit
+            async for piece in _groq_chat_stream(messages):
+                if isinstance(piece, dict) and "__tool_call__" in piece:
+                    tc = piece["__tool_call__"]
+                    if tc.get("id"):
+                        tool_name, args = _parse_tool_call(tc)
+                        yield {"type": "tool_call", "tool": tool_name, "args": args}
+                        pending[tc["id"]] = asyncio.create_task(_call_tool(client, tool_name, args))
+                elif isinstance(piece, dict) and "__final__" in piece:
                     final_msg = piece["__final__"]
-                    break
+                    tool_calls = piece.get("__tool_calls__", [])
                 else:
                     assembled.append(piece)
                     yield {"type": "model_chunk", "text": piece}
-            else:
+            if final_msg is None:
                 final_msg = "".join(assembled)
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             status = getattr(getattr(e, "response", None), "status_code", None)
             if status == 429:
                 final_msg = "The upstream model API returned 429 Too Many Requests. Please wait a few seconds and try again."
             else:
                 final_msg = f"Upstream HTTP error: {str(e)}"
-            yield {"type": "final", "text": final_msg}
+            for task in pending.values():
+                task.cancel()
+            yield {"type": "final", "text": final_msg, "error": True}
             return
         except Exception as e:
-            yield {"type": "final", "text": f"Unexpected error while streaming: {str(e)}"}
+            for task in pending.values():
+                task.cancel()
+            yield {"type": "final", "text": f"Unexpected error while streaming: {str(e)}", "error": True}
             return
 
-        # 2) If streamed text is empty, check for native tool calls via a single non-streaming call
-        try:
-            if final_msg.strip() != "":
-                raise RuntimeError("Skip native tool check; we have final text")
-            # Make a non-streaming call to get the full message with tool_calls
-            payload = {
-                "model": GROQ_MODEL,
-                "messages": messages,
-                "temperature": 0.0,
-                "max_tokens": 1024,
-                "tool_choice": "auto",
-                "tools": [
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "search_code",
-                            "description": "Search for code patterns, functions, or text in the repository",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "query": {"type": "string"},
-                                    "path": {"type": "string"}
-                                },
-                                "required": ["query"],
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "get_file_contents",
-                            "description": "Read the complete contents of a specific file",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {"path": {"type": "string"}},
-                                "required": ["path"],
-                            },
-                        },
-                    },
-                ],
-                "response_format": {"type": "text"},
-            }
-            r = _post_with_retries(payload, stream=False, timeout=60)
-            r.raise_for_status()
-            full_message = r.json()["choices"][0]["message"]
-            tool_calls = full_message.get("tool_calls", [])
-            
-            if tool_calls:
-                # Persist the assistant turn that triggered the tool calls
-                messages.append({
-                    "role": "assistant",
-                    "content": full_message.get("content", ""),
-                    "tool_calls": tool_calls,
-                })
-                # Handle native tool calls
-                for tc in tool_calls:
-                    func = tc.get("function", {})
-                    tool_name = func.get("name")
-                    arg_str = func.get("arguments") or "{}"
-                    try:
-                        args = json.loads(arg_str) if isinstance(arg_str, str) else arg_str
-                    except Exception:
-                        args = {}
-                    
+        # 2) Native tool calls streamed alongside (or instead of) the text
+        if tool_calls:
+            # Persist the assistant turn that triggered the tool calls
+            messages.append({
+                "role": "assistant",
+                "content": final_msg,
+                "tool_calls": tool_calls,
+            })
+            # Most calls were started mid-stream; start any that were not, then wait for all
+            calls = []
+            for tc in tool_calls:
+                tool_name, args = _parse_tool_call(tc)
+                task = pending.pop(tc.get("id"), None)
+                if task is None:
                     yield {"type": "tool_call", "tool": tool_name, "args": args}
-                    
-                    # Call the tool and emit result
-                    try:
-                        result = _call_tool(tool_name, args)
-                        preview = json.dumps(result)[:1200] + ("..." if len(json.dumps(result)) > 1200 else "")
-                        payload = {"type": "tool_result", "tool": tool_name, "preview": preview}
-                        if show_raw_tool:
-                            payload["raw"] = result
-                        yield payload
-                        
-                        # Add tool result to conversation
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tc.get("id"),
-                            "name": tool_name,
-                            "content": json.dumps(result)[:4000],
-                        })
-                    except Exception as ex:
-                        err_msg = f"TOOL_CALL_ERROR: {ex}"
-                        yield {"type": "tool_result", "tool": tool_name, "preview": err_msg}
-                        messages.append({
-                            "role": "tool", 
-                            "tool_call_id": tc.get("id"),
-                            "name": tool_name,
-                            "content": err_msg,
-                        })
-                
-                # Ask model to continue
-                messages.append({"role": "user", "content": "Continue reasoning with the tool results above and provide next step or final answer."})
-                continue
+                    task = asyncio.create_task(_call_tool(client, tool_name, args))
+                calls.append((tc, tool_name, task))
+
+            results = await asyncio.gather(*[task for _, _, task in calls], return_exceptions=True)
+            await _load_token_encoding()
+
+            # Emit results and add them to the conversation in call order
+            for (tc, tool_name, _), result in zip(calls, results):
+                if isinstance(result, Exception):
+                    err_msg = f"TOOL_CALL_ERROR: {result}"
+                    yield {"type": "tool_result", "tool": tool_name, "preview": err_msg}
+                    messages.append({
+                        "role": "tool", 
+                        "tool_call_id": tc.get("id"),
+                        "name": tool_name,
+                        "content": err_msg,
+                    })
+                    continue
+
+                preview, tool_content = _encode_tool_result(result)
+                payload = {"type": "tool_result", "tool": tool_name, "preview": preview}
+                if show_raw_tool:
+                    payload["raw"] = result
+                yield payload
                 
-        except Exception:
-            pass  # Fall back to JSON parsing
+                # Add tool result to conversation
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": tc.get("id"),
+                    "name": tool_name,
+                    "content": tool_content,
+                })
+            
+            # Ask model to continue
+            messages.append({"role": "user", "content": "Continue reasoning with the tool results above and provide next step or final answer."})
+            question_idx = await _compact_history(messages, question_idx)
+            continue
 
-        # 3) Try JSON-based tool calling (fallback)
-        try:
-            stripped = final_msg.strip()
-            start = stripped.find("{")
-            end = stripped.rfind("}")
-            obj = json.loads(stripped[start:end+1])
-        except Exception:
+        # 3) JSON-based tool calling (fallback)
+        if GROQ_NATIVE_TOOLS:
+            obj = _extract_json_object(final_msg)
+        else:
+            # Schema-constrained reply: the whole message is the agent_step object
+            try:
+                obj = orjson.loads(final_msg)
+            except orjson.JSONDecodeError:
+                obj = None
+        if obj is None:
             # Not JSON
             if final_msg.strip() == "":
                 # Avoid emitting an empty final response; ask model to produce an answer
@@ -414,44 +623,81 @@ def ask_agent_stream(user_question, conv_history=None, debug=False, show_raw_too
             yield {"type": "final", "text": final_msg}
             return
 
-        tool = obj.get("tool")
-        args = obj.get("args", {})
-        # Reasoning: normalize common query patterns before tool execution
-        if tool == "search_code":
-            raw_query = args.get("query", "")
-            normalized = re.sub(r"\s+", " ", raw_query).strip()
-            # If likely filename, normalize separators and case
-            if ".py" in normalized or " " not in normalized:
-                normalized = normalized.replace(" `", "").replace("`", "")
-                normalized = normalized.replace("\\", "/")
-            # Also strip punctuation that breaks GitHub search
-            cleaned = re.sub(r"[^\w\.\-/ ]", " ", normalized).strip()
-            if cleaned and cleaned != raw_query:
-                yield {"type": "reasoning", "text": f"Normalized query from '{raw_query}' to '{cleaned}' for reliable search"}
-                args["query"] = cleaned
-            else:
-                yield {"type": "reasoning", "text": f"Using query as-is: '{raw_query}'"}
-            # Strategy note
-            yield {"type": "reasoning", "text": "Strategy: filename match + content search"}
-        yield {"type": "tool_call", "tool": tool, "args": args}
+        # Batched form ("actions": [{tool, args}, ...]); the single "tool"/"args" form is still accepted
+        actions = obj.get("actions")
+        if not isinstance(actions, list):
+            actions = [{"tool": obj.get("tool"), "args": obj.get("args", {})}]
 
-        # 4) call the tool and emit result
-        try:
-            result = _call_tool(tool, args)
-            preview = json.dumps(result)[:1200] + ("..." if len(json.dumps(result)) > 1200 else "")
+        calls = []
+        for step in actions:
+            if not isinstance(step, dict):
+                continue
+            tool = step.get("tool")
+            args = step.get("args") or {}
+            # Reasoning: normalize common query patterns before tool execution
+            if tool == "search_code":
+                raw_query = args.get("query", "")
+                normalized = _WS_RE.sub(" ", raw_query).strip()
+                # If likely filename, normalize separators and case
+                if ".py" in normalized or " " not in normalized:
+                    normalized = normalized.replace(" `", "").replace("`", "")
+                    normalized = normalized.replace("\\", "/")
+                # Also strip punctuation that breaks GitHub search
+                cleaned = _PUNCT_RE.sub(" ", normalized).strip()
+                if cleaned and cleaned != raw_query:
+                    yield {"type": "reasoning", "text": f"Normalized query from '{raw_query}' to '{cleaned}' for reliable search"}
+                    args["query"] = cleaned
+                else:
+                    yield {"type": "reasoning", "text": f"Using query as-is: '{raw_query}'"}
+                # Strategy note
+                yield {"type": "reasoning", "text": "Strategy: filename match + content search"}
+            yield {"type": "tool_call", "tool": tool, "args": args}
+            calls.append((tool, args))
+
+        # 4) run the tools concurrently and emit results in order
+        results = await asyncio.gather(*[_call_tool(client, tool, args) for tool, args in calls], return_exceptions=True)
+        await _load_token_encoding()
+        for (tool, _), result in zip(calls, results):
+            if isinstance(result, Exception):
+                err_msg = f"TOOL_CALL_ERROR: {result}"
+                yield {"type": "tool_result", "tool": tool, "preview": err_msg}
+                messages.append({"role": "assistant", "content": f"TOOL_RESULT: {err_msg}"})
+                continue
+
+            preview, tool_content = _encode_tool_result(result)
             payload = {"type": "tool_result", "tool": tool, "preview": preview}
             if show_raw_tool:
                 payload["raw"] = result
             yield payload
-        except Exception as ex:
-            err_msg = f"TOOL_CALL_ERROR: {ex}"
-            yield {"type": "tool_result", "tool": tool, "preview": err_msg}
-            # Don't continue with undefined result variable
-            messages.append({"role": "assistant", "content": f"TOOL_RESULT: {err_msg}"})
-            messages.append({"role": "user", "content": "Continue reasoning with the tool result above and provide next step or final answer."})
-            continue
 
-        # 5) add tool result to conversation and loop back to the model
-        messages.append({"role": "assistant", "content": f"TOOL_RESULT: {json.dumps(result)[:4000]}"})
+            # 5) add tool result to conversation
+            messages.append({"role": "assistant", "content": f"TOOL_RESULT: {tool_content}"})
+
+        # ...and loop back to the model
         messages.append({"role": "user", "content": "Continue reasoning with the tool result above and provide next step or final answer."})
+        question_idx = await _compact_history(messages, question_idx)
         # loop continues to stream the next assistant message
+
+
+def ask_agent_stream_sync(user_question, conv_history=None, debug=False, show_raw_tool=False, repo=None):
+    """
+    Blocking wrapper around ask_agent_stream for synchronous callers.
+    Drives the async generator on a private event loop and yields the same events.
+    """
+    loop = asyncio.new_event_loop()
+    agen = ask_agent_stream(user_question, conv_history=conv_history, debug=debug, show_raw_tool=show_raw_tool, repo=repo)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        # Let background work started on this loop finish before it closes
+        pending = [t for t in _background_tasks if t.get_loop() is loop]
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(transport.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
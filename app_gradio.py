@@ -1,95 +1,174 @@
 # app_gradio.py #
 import gradio as gr
 from agent import ask_agent_stream, github_client
-from dotenv import load_dotenv
-import json
-load_dotenv()
+import asyncio
+from collections import deque
+import orjson
+from settings import CHAT_CONCURRENCY, MAX_TURNS
 
 EVENT_HEADER = "### 🔧 Tool Execution Log\n"
-def stream_reply(user_message, history, show_raw_tool):
+# Streamed text is pushed to the UI at most every FLUSH_MS, or once FLUSH_CHARS new characters arrived
+FLUSH_MS = 40
+FLUSH_CHARS = 64
+# The tool log shows only the newest entries, so each update stays small on long runs
+EVENT_LOG_MAX_ENTRIES = 50
+
+def _pretty_json(value):
+    """Indented JSON for the tool log"""
+    return orjson.dumps(value, default=str, option=orjson.OPT_INDENT_2).decode()
+
+def _render_event_log(entries, total):
+    """Markdown for the tool log from its newest entries; total counts all entries so far"""
+    hidden = total - len(entries)
+    note = f"- … {hidden} earlier entries not shown\n" if hidden else ""
+    return EVENT_HEADER + note + "".join(entries)
+
+async def _produce_events(queue, user_message, conv_history, show_raw_tool, repo):
+    """Push agent events onto queue, then a final None"""
+    agen = ask_agent_stream(user_message, conv_history=conv_history, debug=True, show_raw_tool=show_raw_tool, repo=repo)
+    try:
+        async for event in agen:
+            await queue.put(event)
+    finally:
+        await agen.aclose()
+        queue.put_nowait(None)
+
+async def stream_reply(user_message, history, conv_history, show_raw_tool, repo):
     """
     Streaming handler for Gradio.
     We progressively update the last assistant message and the event log.
+    conv_history is the agent-format context kept in session state: one user/assistant
+    pair is appended per finished turn and only the last MAX_TURNS pairs are kept.
+    Agent events are read from a queue and applied in batches: the UI gets one update
+    per FLUSH_MS tick (sooner once FLUSH_CHARS of new text is pending), not one per event.
+    repo is the session's "owner/name"; it is updated if the agent switched repositories.
     """
     if not user_message:
-        yield history, history, EVENT_HEADER
+        yield history, history, conv_history, EVENT_HEADER, repo
         return
 
     # Prime the chat with a placeholder assistant message
     history = history + [[user_message, ""]]
-    event_log = EVENT_HEADER
-
-    # Build a minimal conv history for the agent (optional but nice for context)
-    conv_history = []
-    # history includes the new empty assistant entry, so build from all but the last
-    for i, pair in enumerate(history[:-1]):
-        user_msg, bot_msg = pair
-        conv_history.append({"role": "user", "content": user_msg})
-        conv_history.append({"role": "assistant", "content": bot_msg})
+    log_entries = deque(maxlen=EVENT_LOG_MAX_ENTRIES)
+    log_total = 0
+    event_log = EVENT_HEADER  # rendered lazily; None once new entries are pending
 
     # Stream events from the agent
-    partial = []
-    for event in ask_agent_stream(user_message, conv_history=conv_history, debug=True, show_raw_tool=show_raw_tool):
-        etype = event.get("type")
-        if etype == "model_chunk":
-            partial.append(event["text"])
-            history[-1][1] = "".join(partial)
-            yield history, history, event_log
-
-        elif etype == "tool_call":
-            tool = event["tool"]
-            args = event.get("args", {})
-            event_log += f"- 🛠️ **Executing** `{tool}`\n"
-            if args:
-                event_log += f"  - Args: `{json.dumps(args, indent=2)}`\n"
-            yield history, history, event_log
-
-        elif etype == "reasoning":
-            note = event.get("text", "")
-            if note:
-                event_log += f"- 🧠 **Reasoning**: {note}\n"
-            yield history, history, event_log
-
-        elif etype == "tool_result":
-            tool = event["tool"]
-            preview = event.get("preview", "")
-            event_log += f"- ✅ **Completed** `{tool}`\n"
-            if preview and len(preview) < 500:
-                event_log += f"  - Result: `{preview}`\n"
-            elif preview:
-                event_log += f"  - Result: `{preview[:200]}...`\n"
-            
-            # If user wants raw results, append nicely below
-            raw = event.get("raw")
-            if raw is not None and show_raw_tool:
-                event_log += f"\n<details><summary>📋 Raw Data</summary>\n\n```json\n{json.dumps(raw, indent=2)}\n```\n</details>\n"
-            yield history, history, event_log
-
-        elif etype == "final":
-            final_text = event.get("text", "")
-            if not partial:  # if nothing streamed (e.g., JSON only), show the final now
-                history[-1][1] = final_text
-            else:
-                # make sure any final delta is appended
-                history[-1][1] = "".join(partial) if final_text == "" else final_text
-            yield history, history, event_log
-            return
+    queue = asyncio.Queue()
+    producer = asyncio.create_task(_produce_events(queue, user_message, conv_history, show_raw_tool, repo))
+    loop = asyncio.get_running_loop()
+    getter = None
+    current = ""
+    flushed_len = 0
+    deadline = None  # flush time for the pending batch; None while nothing is pending
+    try:
+        while True:
+            # A single long-lived get() survives tick timeouts, so no event is dropped
+            if getter is None:
+                getter = asyncio.ensure_future(queue.get())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            await asyncio.wait({getter}, timeout=timeout)
+            if not getter.done():
+                deadline = None
+                flushed_len = len(current)
+                if event_log is None:
+                    event_log = _render_event_log(log_entries, log_total)
+                yield history, history, conv_history, event_log, repo
+                continue
+            event = getter.result()
+            getter = None
+            if event is None:
+                break
+
+            etype = event.get("type")
+            entry = ""
+            if etype == "model_chunk":
+                current += event["text"]
+                history[-1][1] = current
+
+            elif etype == "tool_call":
+                tool = event["tool"]
+                args = event.get("args", {})
+                entry += f"- 🛠️ **Executing** `{tool}`\n"
+                if args:
+                    entry += f"  - Args: `{_pretty_json(args)}`\n"
 
+            elif etype == "reasoning":
+                note = event.get("text", "")
+                if note:
+                    entry += f"- 🧠 **Reasoning**: {note}\n"
+
+            elif etype == "tool_result":
+                tool = event["tool"]
+                preview = event.get("preview", "")
+                entry += f"- ✅ **Completed** `{tool}`\n"
+                if preview and len(preview) < 500:
+                    entry += f"  - Result: `{preview}`\n"
+                elif preview:
+                    entry += f"  - Result: `{preview[:200]}...`\n"
+                
+                # If user wants raw results, append nicely below
+                raw = event.get("raw")
+                if raw is not None and show_raw_tool:
+                    entry += f"\n<details><summary>📋 Raw Data</summary>\n\n```json\n{_pretty_json(raw)}\n```\n</details>\n"
+
+            elif etype == "final":
+                final_text = event.get("text", "")
+                if not current:  # if nothing streamed (e.g., JSON only), show the final now
+                    history[-1][1] = final_text
+                else:
+                    # make sure any final delta is appended
+                    history[-1][1] = current if final_text == "" else final_text
+                conv_history = conv_history + [
+                    {"role": "user", "content": user_message},
+                    {"role": "assistant", "content": history[-1][1]},
+                ]
+                conv_history = conv_history[-2 * MAX_TURNS:] if MAX_TURNS > 0 else []
+                repo = event.get("repo", repo)
+                if event_log is None:
+                    event_log = _render_event_log(log_entries, log_total)
+                yield history, history, conv_history, event_log, repo
+                return
+
+            if entry:
+                log_entries.append(entry)
+                log_total += 1
+                event_log = None
+
+            if len(current) - flushed_len >= FLUSH_CHARS:
+                deadline = loop.time()
+            elif deadline is None:
+                deadline = loop.time() + FLUSH_MS / 1000
+    finally:
+        if getter is not None:
+            getter.cancel()
+        producer.cancel()
+
+    # Surface a crash in the agent stream instead of ending silently
+    await producer
     # Safety return in case generator exits unexpectedly
-    yield history, history, event_log
+    yield history, history, conv_history, _render_event_log(log_entries, log_total), repo
 
-def switch_repository(owner, repo):
-    """Switch to a different GitHub repository"""
+def _repo_label(repo):
+    """Markdown for the current repository line"""
+    return f"Current Repository: **{repo}**"
+
+async def switch_repository(owner, repo, current):
+    """Switch this session to a different GitHub repository (other sessions keep theirs)"""
     try:
-        result = github_client.switch_repo(owner, repo)
-        return f"✅ {result}", f"Current Repository: **{owner}/{repo}**"
+        if not owner or not repo:
+            raise ValueError("owner and repository are required")
+        # Fresh data for the new repository, as GitHubClient.switch_repo does
+        github_client.clear_cache(owner, repo)
+        return f"✅ Switched to repository: {owner}/{repo}", _repo_label(f"{owner}/{repo}"), f"{owner}/{repo}"
     except Exception as e:
-        return f"❌ Error switching repository: {str(e)}", f"Current Repository: **{github_client.get_current_repo()}**"
+        return f"❌ Error switching repository: {str(e)}", _repo_label(current), current
 
-def get_current_repo_info():
-    """Get current repository information"""
+async def get_current_repo_info(repo):
+    """Get information about the session's repository"""
     try:
-        info = github_client.get_repo_info()
+        owner, name = repo.split("/", 1)
+        info = await github_client.for_repo(owner, name).get_repo_info()
         if "error" in info:
             return f"❌ Error: {info['error']}"
         
@@ -128,6 +207,8 @@ with gr.Blocks(fill_height=True, title="AI Code Mate") as demo:
         with gr.Column(scale=1):
             # Repository Management
             gr.Markdown("### 📁 Repository Management")
+            # "owner/name" this session works on; the shared GitHub client is never switched
+            repo_state = gr.State(github_client.get_current_repo())
             
             with gr.Row():
                 repo_owner = gr.Textbox(
@@ -137,21 +218,29 @@ with gr.Blocks(fill_height=True, title="AI Code Mate") as demo:
                 )
                 repo_name = gr.Dropdown(label="Repository", choices=[], value=None)
             
-            def load_repos(owner):
+            async def load_repos(owner, repo):
                 try:
-                    names = github_client.list_repos_for_owner(owner)
+                    names = await github_client.list_repos_for_owner(owner)
                     # Return choices and a default selection (keep current if present)
-                    current = github_client.get_current_repo().split("/")[-1]
+                    current = repo.split("/")[-1]
                     default = current if current in names else (names[0] if names else None)
                     return gr.Dropdown(choices=names, value=default)
                 except Exception:
                     return gr.Dropdown(choices=[], value=None)
             
             load_btn = gr.Button("🔁 Load Repos", variant="secondary")
-            load_btn.click(load_repos, inputs=[repo_owner], outputs=[repo_name], queue=False)
+            # Disabled while loading so repeated clicks don't fire duplicate requests;
+            # results are cached per owner by the GitHub client
+            load_btn.click(
+                lambda: gr.update(interactive=False), outputs=[load_btn], queue=False
+            ).then(
+                load_repos, inputs=[repo_owner, repo_state], outputs=[repo_name], queue=False, show_progress="minimal"
+            ).then(
+                lambda: gr.update(interactive=True), outputs=[load_btn], queue=False
+            )
             
             switch_btn = gr.Button("🔄 Switch Repository", variant="secondary")
-            current_repo_display = gr.Markdown(f"Current Repository: **{github_client.get_current_repo()}**")
+            current_repo_display = gr.Markdown(_repo_label(github_client.get_current_repo()))
             
             repo_info_btn = gr.Button("ℹ️ Repository Info", variant="secondary")
             repo_info_display = gr.Markdown("Click 'Repository Info' to see details")
@@ -164,45 +253,49 @@ with gr.Blocks(fill_height=True, title="AI Code Mate") as demo:
             event_md = gr.Markdown(EVENT_HEADER, elem_id="event_log", height=300)
 
     state = gr.State([])  # chat history
+    conv_state = gr.State([])  # agent context: the last MAX_TURNS user/assistant pairs
 
-    def submit_fn(message, history, show_raw_tool):
-        # Yield directly from the stream_reply generator
-        yield from stream_reply(message, history, show_raw_tool)
-
-    # Chat functionality
+    # Chat functionality; the agent may switch the session's repository, so refresh its label after
     send.click(
-        submit_fn,
-        inputs=[txt, state, show_raw],
-        outputs=[chat, state, event_md],
+        stream_reply,
+        inputs=[txt, state, conv_state, show_raw, repo_state],
+        outputs=[chat, state, conv_state, event_md, repo_state],
         queue=True,
         show_progress=True,
-    )
+        concurrency_limit=CHAT_CONCURRENCY,
+        concurrency_id="chat",
+    ).then(_repo_label, inputs=[repo_state], outputs=[current_repo_display], queue=False)
     txt.submit(
-        submit_fn,
-        inputs=[txt, state, show_raw],
-        outputs=[chat, state, event_md],
+        stream_reply,
+        inputs=[txt, state, conv_state, show_raw, repo_state],
+        outputs=[chat, state, conv_state, event_md, repo_state],
         queue=True,
         show_progress=True,
-    )
+        concurrency_limit=CHAT_CONCURRENCY,
+        concurrency_id="chat",
+    ).then(_repo_label, inputs=[repo_state], outputs=[current_repo_display], queue=False)
     
     # Repository switching functionality
     switch_btn.click(
         switch_repository,
-        inputs=[repo_owner, repo_name],
-        outputs=[gr.Textbox(visible=False), current_repo_display],
+        inputs=[repo_owner, repo_name, repo_state],
+        outputs=[gr.Textbox(visible=False), current_repo_display, repo_state],
         queue=False
     )
     
     # Repository info functionality
     repo_info_btn.click(
         get_current_repo_info,
+        inputs=[repo_state],
         outputs=[repo_info_display],
         queue=False
     )
 
 if __name__ == "__main__":
-    demo.queue().launch(
+    demo.queue(default_concurrency_limit=CHAT_CONCURRENCY, max_size=64).launch(
     share=False,
     server_name="0.0.0.0",
-    server_port=7860
+    server_port=7860,
+    # Worker threads for sync handlers (sets anyio's default thread limiter)
+    max_threads=64
 )
@@ -3,17 +3,70 @@
 Simplified GitHub client for repository operations
 """
 import os
-import requests
+import asyncio
+import base64
+import copy
+import httpx
 import json
-from typing import Dict, List, Optional
-from dotenv import load_dotenv
+import orjson
+from typing import Any, Dict, List, Optional
+from cachetools import LRUCache, TTLCache
+from settings import GITHUB_OWNER, GITHUB_REPO, GITHUB_TOKEN
+from transport import Transport
 
-load_dotenv()
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# How long (seconds) cached GitHub responses stay fresh, per tool
+CACHE_TTLS = {
+    "get_repo_info": 300,
+    "list_repos_for_owner": 300,
+    "get_file_tree": 120,
+    "list_files": 120,
+    "get_file_contents": 60,
+    "search_code": 30,
+}
+
+# Media type that makes the contents API return the file itself (no JSON, no base64)
+RAW_MEDIA_TYPE = "application/vnd.github.raw"
+
+# File types that are never useful as text; get_file_contents skips them without a request
+BINARY_EXTS = frozenset({
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".svgz",
+    ".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".tar", ".jar", ".whl",
+    ".exe", ".dll", ".so", ".dylib", ".a", ".o", ".class", ".pyc", ".pyo",
+    ".woff", ".woff2", ".ttf", ".otf", ".eot",
+    ".mp3", ".mp4", ".wav", ".ogg", ".mov", ".avi", ".webm",
+    ".npz", ".npy", ".pkl", ".pt", ".bin", ".onnx", ".sqlite", ".db",
+})
+
+# Repository listings are fetched 100 per page, up to this many pages
+REPO_LIST_MAX_PAGES = 10
+
+# One GraphQL query serves users and orgs alike and returns only the names;
+# OWNER only, so collaborations on other owners' repos are left out (as in the REST listing)
+REPOS_QUERY = """
+query($login: String!, $cursor: String) {
+  repositoryOwner(login: $login) {
+    repositories(first: 100, after: $cursor, ownerAffiliations: OWNER) {
+      nodes { name }
+      pageInfo { endCursor hasNextPage }
+    }
+  }
+}
+"""
+
+def _loads(response: httpx.Response) -> Any:
+    """Decode a JSON response body with orjson (tree listings can be large)"""
+    return orjson.loads(response.content)
 
 class GitHubClient:
-    def __init__(self, token: Optional[str] = None):
-        self.token = token or os.getenv("GITHUB_TOKEN")
-        self.base_url = "https://api.github.com"
+    def __init__(self, transport: Optional[Transport] = None, token: Optional[str] = None):
+        # HTTP goes through the (shared) async transport
+        self.transport = transport or Transport()
+        self.token = token or GITHUB_TOKEN
         self.headers = {
             "Accept": "application/vnd.github.v3+json",
             "User-Agent": "ai-code-mate-demo"
@@ -21,28 +74,121 @@ class GitHubClient:
         if self.token:
             self.headers["Authorization"] = f"token {self.token}"
         
-        self.current_owner = os.getenv("GITHUB_OWNER")
-        self.current_repo = os.getenv("GITHUB_REPO")
+        self.current_owner = GITHUB_OWNER
+        self.current_repo = GITHUB_REPO
+
+        # Response caches keyed by (owner, repo, path, params); one per tool so TTLs can differ
+        self._caches = {name: TTLCache(maxsize=512, ttl=ttl) for name, ttl in CACHE_TTLS.items()}
+        # Last (ETag, body) per request, used to revalidate with If-None-Match
+        self._etags = LRUCache(maxsize=512)
+        # (owner, repo, tree_sha) -> (lowered_names, basename_map), see _get_path_index
+        self._path_index: Dict[tuple, tuple] = {}
+        # (owner, repo) -> ETag of the streamed tree behind that repository's path index
+        self._path_index_etags: Dict[tuple, str] = {}
     
+    def for_repo(self, owner: str, repo: str) -> "GitHubClient":
+        """
+        Client for another repository that shares this one's transport, caches and ETags.
+        Switching repos on the copy leaves this client (and other copies) untouched.
+        """
+        client = copy.copy(self)
+        client.current_owner = owner
+        client.current_repo = repo
+        return client
+
     def switch_repo(self, owner: str, repo: str):
         """Switch to a different repository"""
         self.current_owner = owner
         self.current_repo = repo
+        self.clear_cache(owner, repo)
         return f"Switched to repository: {owner}/{repo}"
+
+    def clear_cache(self, owner: Optional[str] = None, repo: Optional[str] = None):
+        """
+        Drop cached GitHub responses for one repository, or all of them when no repo is given.
+        ETags are kept per repository, so the next read revalidates cheaply with a 304.
+        """
+        if owner is None:
+            for cache in self._caches.values():
+                cache.clear()
+            self._etags.clear()
+            self._path_index_etags.clear()
+            return
+        for cache in self._caches.values():
+            for key in [k for k in cache.keys() if k[:2] == (owner, repo)]:
+                cache.pop(key, None)
+
+    def _cache_key(self, path: str, params: Optional[Dict] = None, accept: Optional[str] = None) -> tuple:
+        return (self.current_owner, self.current_repo, path, json.dumps(params or {}, sort_keys=True), accept)
+
+    async def _cached_get(self, bucket: str, path: str, params: Optional[Dict] = None,
+                          conditional: bool = False, accept: Optional[str] = None) -> Any:
+        """
+        GET a GitHub JSON resource through the TTL cache for `bucket`.
+        With conditional=True the ETag is remembered and sent back as If-None-Match once the
+        TTL expires; a 304 reuses the stored body (and does not count against the rate limit).
+        With accept set (e.g. RAW_MEDIA_TYPE), non-JSON bodies are returned as bytes.
+        Raises httpx errors on failure; errors are never cached.
+        """
+        key = self._cache_key(path, params, accept)
+        cache = self._caches[bucket]
+        if key in cache:
+            return cache[key]
+
+        headers = self.headers
+        if accept:
+            headers = {**headers, "Accept": accept}
+        stored = self._etags.get(key) if conditional else None
+        if stored:
+            headers = {**headers, "If-None-Match": stored[0]}
+
+        response = await self.transport.github_get(path, params=params, headers=headers)
+        if stored and response.status_code == 304:
+            data = stored[1]
+        else:
+            response.raise_for_status()
+            if accept and not response.headers.get("Content-Type", "").startswith("application/json"):
+                data = response.content
+            else:
+                data = _loads(response)
+            etag = response.headers.get("ETag")
+            if conditional and etag:
+                self._etags[key] = (etag, data)
+
+        cache[key] = data
+        return data
     
     def get_current_repo(self) -> str:
         """Get current repository identifier"""
         return f"{self.current_owner}/{self.current_repo}"
+
+    def run_sync(self, method, *args, **kwargs):
+        """
+        Call an async client method from synchronous code (scripts, REPL), e.g.
+        client.run_sync(client.get_repo_info). Not for use inside a running event loop.
+        """
+        async def _run():
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                await self.transport.aclose()
+        return asyncio.run(_run())
     
-    def search_code(self, query: str, path: str = "") -> Dict:
+    async def search_code(self, query: str, path: str = "") -> Dict:
         """Search for code in the current repository"""
-        # First try to find files by name using the repository contents API
-        filename_results = self._search_files_by_name(query, path)
+        # Filename matches (tree index) and content matches (code search API) concurrently
+        filename_results, content_results = await asyncio.gather(
+            self._search_files_by_name(query, path),
+            self._search_code_content(query, path),
+        )
         
-        # Then try GitHub's code search API for content
-        content_results = self._search_code_content(query, path)
-        
-        # Combine results
+        # Combine results; a file matched by name is not listed again as a content match
+        matched_paths = {match["path"] for match in filename_results}
+        if "items" in content_results:
+            content_results = {
+                **content_results,
+                "items": [item for item in content_results["items"] if item.get("path") not in matched_paths],
+            }
         combined_results = {
             "filename_matches": filename_results,
             "content_matches": content_results,
@@ -51,105 +197,245 @@ class GitHubClient:
         
         return combined_results
     
-    def _search_files_by_name(self, query: str, path: str = "") -> List[Dict]:
-        """Search for files by name using repository contents API"""
+    async def _search_files_by_name(self, query: str, path: str = "") -> List[Dict]:
+        """
+        Search for files by name: substring match on file names over the cached tree index.
+        Only when the tree cannot be fetched is GitHub's filename: qualifier used instead. That
+        costs a request against the small code search rate limit (about 10/min) and matches
+        whole file names server-side, so it can return fewer hits than the tree match.
+        """
+        index = await self._get_path_index()
+        if index is not None:
+            return self._match_file_names(index, query, path)
+        return await self._search_filename_qualifier(query, path)
+
+    async def _search_filename_qualifier(self, query: str, path: str = "") -> List[Dict]:
+        """Filename search through /search/code with the filename: qualifier"""
+        search_query = f"filename:{query} repo:{self.current_owner}/{self.current_repo}"
+        if path:
+            search_query += f" path:{path}"
+
         try:
-            # Get all files in the repository
-            tree_data = self.get_file_tree("")
-            if "error" in tree_data:
-                return []
-            
-            files = tree_data.get("tree", [])
-            matches = []
-            
-            for file_info in files:
-                if file_info.get("type") == "blob":  # It's a file
-                    file_path = file_info.get("path", "")
-                    file_name = file_path.split("/")[-1]  # Get just the filename
-                    
-                    # Check if query matches filename (case-insensitive)
-                    if query.lower() in file_name.lower():
-                        # If path filter is specified, check if file is in that path
-                        if not path or path in file_path:
-                            matches.append({
-                                "path": file_path,
-                                "name": file_name,
-                                "type": "filename_match",
-                                "url": f"https://github.com/{self.current_owner}/{self.current_repo}/blob/main/{file_path}"
-                            })
-            
-            return matches
-            
-        except Exception as e:
+            data = await self._cached_get("search_code", "/search/code", {"q": search_query})
+        except httpx.HTTPError:
             return []
+
+        matches = []
+        seen = set()
+        for item in data.get("items", []):
+            file_path = item.get("path", "")
+            if file_path and file_path not in seen:
+                seen.add(file_path)
+                matches.append(self._filename_match(file_path))
+        return matches
+
+    def _filename_match(self, file_path: str) -> Dict:
+        return {
+            "path": file_path,
+            "name": file_path.split("/")[-1],
+            "type": "filename_match",
+            "url": f"https://github.com/{self.current_owner}/{self.current_repo}/blob/main/{file_path}"
+        }
+
+    def _match_file_names(self, index: tuple, query: str, path: str = "") -> List[Dict]:
+        """Filename matches from a path index (see _get_path_index)"""
+        lowered_names, basename_map = index
+        query_lower = query.lower()
+
+        # Whole file name hits (a dict lookup) come first, then the other substring matches
+        file_paths = list(basename_map.get(query_lower, ()))
+        exact = set(file_paths)
+        file_paths += [p for name, p in lowered_names if query_lower in name and p not in exact]
+        if path:
+            file_paths = [p for p in file_paths if path in p]
+        return [self._filename_match(p) for p in file_paths]
+
+    async def _get_path_index(self) -> Optional[tuple]:
+        """
+        (lowered_names, basename_map) for the current repository tree: a list of
+        (lowercase file name, path) pairs and a lowercase file name -> paths dict.
+        Built once per (owner, repo, tree_sha); None if the tree cannot be fetched.
+        With ijson installed the tree is parsed while it downloads, never held as a whole.
+        """
+        if ijson is not None:
+            return await self._stream_path_index()
+        tree_data = await self.get_file_tree("")
+        if "error" in tree_data:
+            return None
+        key = (self.current_owner, self.current_repo, tree_data.get("sha"))
+        index = self._path_index.get(key)
+        if index is None:
+            index = self._store_path_index(key, (
+                file_info["path"]
+                for file_info in tree_data.get("tree", [])
+                if file_info.get("type") == "blob" and file_info.get("path")
+            ))
+        return index
+
+    def _store_path_index(self, key: tuple, file_paths) -> tuple:
+        lowered_names = [(file_path.rsplit("/", 1)[-1].lower(), file_path) for file_path in file_paths]
+        basename_map: Dict[str, List[str]] = {}
+        for name, file_path in lowered_names:
+            basename_map.setdefault(name, []).append(file_path)
+        # The tree moved on: drop indexes of older trees of this repository
+        for stale in [k for k in self._path_index if k[:2] == key[:2]]:
+            del self._path_index[stale]
+        index = self._path_index[key] = (lowered_names, basename_map)
+        return index
+
+    async def _stream_path_index(self) -> Optional[tuple]:
+        """
+        _get_path_index with the recursive tree parsed incrementally by ijson.
+        Freshness follows get_file_tree: reused within its TTL, then revalidated by ETag.
+        """
+        repo_key = (self.current_owner, self.current_repo)
+        # Cache entries are keyed like _cache_key, so clear_cache() drops this one too
+        fresh_key = repo_key + ("path_index", "", None)
+        cache = self._caches["get_file_tree"]
+        key = cache.get(fresh_key)
+        if key in self._path_index:
+            return self._path_index[key]
+
+        current = next((k for k in self._path_index if k[:2] == repo_key), None)
+        headers = self.headers
+        etag = self._path_index_etags.get(repo_key)
+        if current and etag:
+            headers = {**headers, "If-None-Match": etag}
+        url = f"/repos/{self.current_owner}/{self.current_repo}/git/trees/main"
+        try:
+            async with self.transport.github_stream(url, params={"recursive": 1}, headers=headers) as response:
+                if current and response.status_code == 304:
+                    key = current
+                else:
+                    response.raise_for_status()
+                    sha, file_paths = await self._parse_tree_stream(response)
+                    key = repo_key + (sha,)
+                    self._store_path_index(key, file_paths)
+                    if response.headers.get("ETag"):
+                        self._path_index_etags[repo_key] = response.headers["ETag"]
+        except (httpx.HTTPError, ijson.JSONError):
+            return None
+        cache[fresh_key] = key
+        return self._path_index[key]
+
+    @staticmethod
+    async def _parse_tree_stream(response: httpx.Response) -> tuple:
+        """(tree sha, blob paths) from a streamed git/trees response, parsed chunk by chunk"""
+        events = ijson.sendable_list()
+        parser = ijson.parse_coro(events)
+        sha = None
+        file_paths: List[str] = []
+        item_path = item_type = None
+        async for chunk in response.aiter_bytes(65536):
+            parser.send(chunk)
+            for prefix, event, value in events:
+                if prefix == "tree.item.path":
+                    item_path = value
+                elif prefix == "tree.item.type":
+                    item_type = value
+                elif prefix == "tree.item" and event == "end_map":
+                    if item_type == "blob" and item_path:
+                        file_paths.append(item_path)
+                    item_path = item_type = None
+                elif prefix == "sha":
+                    sha = value
+            del events[:]
+        parser.close()
+        return sha, file_paths
     
-    def _search_code_content(self, query: str, path: str = "") -> Dict:
+    async def _search_code_content(self, query: str, path: str = "") -> Dict:
         """Search for code content using GitHub's search API"""
         search_query = f"{query} repo:{self.current_owner}/{self.current_repo}"
         if path:
             search_query += f" path:{path}"
         
-        url = f"{self.base_url}/search/code"
         params = {"q": search_query}
         
         try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return await self._cached_get("search_code", "/search/code", params)
+        except httpx.HTTPError as e:
             return {"error": f"Content search failed: {str(e)}"}
     
-    def get_file_contents(self, path: str) -> str:
+    async def get_file_contents(self, path: str) -> str:
         """Get the contents of a specific file"""
-        url = f"{self.base_url}/repos/{self.current_owner}/{self.current_repo}/contents/{path}"
+        if os.path.splitext(path)[1].lower() in BINARY_EXTS:
+            return f"Skipped {path}: binary file"
+        url = f"/repos/{self.current_owner}/{self.current_repo}/contents/{path}"
         
         try:
-            response = requests.get(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            file_data = response.json()
+            try:
+                # Raw media type: the body is the file itself
+                file_data = await self._cached_get("get_file_contents", url, conditional=True, accept=RAW_MEDIA_TYPE)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in (406, 415):
+                    raise
+                # Raw not accepted: use the JSON + base64 representation
+                file_data = await self._cached_get("get_file_contents", url, conditional=True)
             
-            if file_data.get("type") == "file":
-                import base64
-                content = base64.b64decode(file_data["content"]).decode("utf-8", errors="replace")
-                return content
+            if isinstance(file_data, bytes):
+                raw = file_data
+            elif isinstance(file_data, dict) and file_data.get("type") == "file":
+                raw = base64.b64decode(file_data["content"])
             else:
+                # Directories come back as a JSON listing even with the raw media type
                 return f"Path {path} is not a file"
+
+            # Unknown extension but binary content (NUL bytes near the start)
+            if b"\x00" in raw[:8192]:
+                return f"Skipped {path}: binary file"
+            content = raw.decode("utf-8", errors="replace")
+            return content
                 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             return f"Error fetching file {path}: {str(e)}"
     
-    def list_files(self, path: str = ".") -> List[Dict]:
+    async def list_files(self, path: str = ".") -> List[Dict]:
         """List files in a directory"""
-        url = f"{self.base_url}/repos/{self.current_owner}/{self.current_repo}/contents/{path}"
+        url = f"/repos/{self.current_owner}/{self.current_repo}/contents/{path}"
         
         try:
-            response = requests.get(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return await self._cached_get("list_files", url, conditional=True)
+        except httpx.HTTPError as e:
             return [{"error": f"Failed to list files: {str(e)}"}]
 
-    def list_repos_for_owner(self, owner: Optional[str] = None) -> List[str]:
+    async def list_repos_for_owner(self, owner: Optional[str] = None) -> List[str]:
         """List repositories for a user/org owner. Returns repo names."""
         owner_to_use = owner or self.current_owner
         if not owner_to_use:
             return []
-        headers = self.headers
+        cache = self._caches["list_repos_for_owner"]
+        key = (owner_to_use, None, "repos", "")
+        if key in cache:
+            return cache[key]
         repos: List[str] = []
-        # Try user endpoint
-        urls = [
-            f"{self.base_url}/users/{owner_to_use}/repos?per_page=100",
-            f"{self.base_url}/orgs/{owner_to_use}/repos?per_page=100",
-        ]
-        for url in urls:
+        # GraphQL needs a token; without one (or if it fails) use the REST listings
+        names = None
+        if self.token:
             try:
-                r = requests.get(url, headers=headers, timeout=30)
-                if r.status_code == 200:
-                    data = r.json()
-                    repos.extend([item.get("name", "") for item in data if item.get("name")])
-                    break
-            except requests.exceptions.RequestException:
-                continue
+                names = await self._graphql_repo_names(owner_to_use)
+            except (httpx.HTTPError, KeyError, TypeError):
+                names = None
+        if names is not None:
+            repos.extend(names)
+        else:
+            # Owner may be a user or an org: query both at once and take the first 200
+            urls = [
+                f"/users/{owner_to_use}/repos",
+                f"/orgs/{owner_to_use}/repos",
+            ]
+            tasks = [asyncio.create_task(self._fetch_repo_names(url)) for url in urls]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    try:
+                        names = await next_done
+                    except httpx.HTTPError:
+                        continue
+                    if names is not None:
+                        repos.extend(names)
+                        break
+            finally:
+                for task in tasks:
+                    task.cancel()
         # De-duplicate while preserving order
         seen = set()
         unique = []
@@ -157,47 +443,68 @@ class GitHubClient:
             if name not in seen:
                 seen.add(name)
                 unique.append(name)
+        if unique:
+            cache[key] = unique
         return unique
     
-    def get_repo_info(self) -> Dict:
+    async def _graphql_repo_names(self, owner: str) -> Optional[List[str]]:
+        """Repo names via GraphQL, following the cursor; None if the owner does not exist"""
+        names: List[str] = []
+        cursor = None
+        for _ in range(REPO_LIST_MAX_PAGES):
+            body = {"query": REPOS_QUERY, "variables": {"login": owner, "cursor": cursor}}
+            r = await self.transport.github_post("/graphql", body, headers=self.headers)
+            r.raise_for_status()
+            owner_data = (_loads(r).get("data") or {}).get("repositoryOwner")
+            if owner_data is None:
+                return None
+            repositories = owner_data["repositories"]
+            names.extend(node["name"] for node in repositories["nodes"] if node)
+            if not repositories["pageInfo"]["hasNextPage"]:
+                break
+            cursor = repositories["pageInfo"]["endCursor"]
+        return names
+
+    async def _fetch_repo_names(self, url: str) -> Optional[List[str]]:
+        """Repo names from a /users or /orgs listing, following Link pages; None unless the owner exists there"""
+        names: List[str] = []
+        for page in range(1, REPO_LIST_MAX_PAGES + 1):
+            r = await self.transport.github_get(url, params={"per_page": 100, "page": page}, headers=self.headers)
+            if r.status_code != 200:
+                return names if page > 1 else None
+            names.extend(item.get("name", "") for item in _loads(r) if item.get("name"))
+            if "next" not in r.links:
+                break
+        return names
+
+    async def get_repo_info(self) -> Dict:
         """Get information about the current repository"""
-        url = f"{self.base_url}/repos/{self.current_owner}/{self.current_repo}"
+        url = f"/repos/{self.current_owner}/{self.current_repo}"
         
         try:
-            response = requests.get(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return await self._cached_get("get_repo_info", url)
+        except httpx.HTTPError as e:
             return {"error": f"Failed to get repo info: {str(e)}"}
     
-    def get_file_tree(self, path: str = "") -> Dict:
-        """Get the file tree structure"""
-        url = f"{self.base_url}/repos/{self.current_owner}/{self.current_repo}/git/trees/main"
-        if path:
-            url += f"?recursive=1"
+    async def get_file_tree(self, path: str = "") -> Dict:
+        """
+        Get the recursive file tree of the repository, or of the sub-directory `path`
+        (addressed as main:<path>, so no separate lookup of its sha); entry paths are
+        relative to that directory.
+        """
+        path = path.strip("/")
+        ref = f"main:{path}" if path else "main"
+        url = f"/repos/{self.current_owner}/{self.current_repo}/git/trees/{ref}"
+        params = {"recursive": 1}
         
         try:
-            response = requests.get(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return await self._cached_get("get_file_tree", url, params, conditional=True)
+        except httpx.HTTPError as e:
             return {"error": f"Failed to get file tree: {str(e)}"}
     
-    def list_all_files(self) -> List[str]:
+    async def list_all_files(self) -> List[str]:
         """List all files in the repository for debugging"""
-        try:
-            tree_data = self.get_file_tree("")
-            if "error" in tree_data:
-                return []
-            
-            files = tree_data.get("tree", [])
-            file_paths = []
-            
-            for file_info in files:
-                if file_info.get("type") == "blob":  # It's a file
-                    file_paths.append(file_info.get("path", ""))
-            
-            return file_paths
-            
-        except Exception as e:
+        index = await self._get_path_index()
+        if index is None:
             return []
+        return [file_path for _, file_path in index[0]]
@@ -0,0 +1,150 @@
+# semantic_cache.py
+"""
+Semantic answer cache for the agent
+- Embeds user questions with a small local sentence-transformers model
+- Returns a stored answer when a new question is similar enough (cosine similarity)
+- Entries are scoped per repository; embeddings are persisted to an .npz file and the
+  question/answer text to a JSON file next to it, at most every SAVE_INTERVAL seconds
+- numpy and sentence-transformers are optional; without them the cache stays disabled
+"""
+import atexit
+import os
+import threading
+import time
+from typing import Optional
+import orjson
+from settings import (
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_PATH,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    np = None
+    SentenceTransformer = None
+
+# Seconds between writes; add() only marks the cache dirty in between
+SAVE_INTERVAL = 30
+
+
+class SemanticCache:
+    def __init__(self, path: str = SEMANTIC_CACHE_PATH, model_name: str = SEMANTIC_CACHE_MODEL,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = 1000):
+        self.enabled = SEMANTIC_CACHE_ENABLED and np is not None
+        self.path = path
+        self.text_path = os.path.splitext(path)[0] + ".json"
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._model = None
+        self._last_embedding = None
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+        # Row i of embeddings (unit-normalized) belongs to repos[i] / questions[i] / answers[i]
+        self.embeddings = None
+        self.repos = []
+        self.questions = []
+        self.answers = []
+        if self.enabled:
+            self._load()
+            # Write out whatever add() has not persisted yet
+            atexit.register(self.flush)
+
+    def _load(self):
+        """Load persisted entries, if any"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path)
+            embeddings = data["embeddings"].astype(np.float32)
+            with open(self.text_path, "rb") as f:
+                text = orjson.loads(f.read())
+            repos, questions, answers = text["repos"], text["questions"], text["answers"]
+            if not len(embeddings) == len(repos) == len(questions) == len(answers):
+                # The two files were written by different saves: start empty
+                return
+            self.embeddings = embeddings
+            self.repos, self.questions, self.answers = repos, questions, answers
+        except Exception:
+            # Corrupt, incompatible or missing file: start empty
+            self.embeddings = None
+            self.repos, self.questions, self.answers = [], [], []
+
+    def _save(self):
+        """Persist entries; each file is replaced atomically (caller holds the lock)"""
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, embeddings=self.embeddings)
+        os.replace(tmp_path, self.path)
+        tmp_path = self.text_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps({"repos": self.repos, "questions": self.questions, "answers": self.answers}))
+        os.replace(tmp_path, self.text_path)
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def flush(self):
+        """Persist entries added since the last save"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _embed(self, text: str):
+        """Unit-normalized embedding, so cosine similarity is a plain dot product"""
+        # A miss is usually followed by add() for the same question; reuse that embedding
+        if self._last_embedding is not None and self._last_embedding[0] == text:
+            return self._last_embedding[1]
+        if self._model is None:
+            self._model = SentenceTransformer(self.model_name)
+        vec = self._model.encode(text, convert_to_numpy=True).astype(np.float32)
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec = vec / norm
+        self._last_embedding = (text, vec)
+        return vec
+
+    def lookup(self, repo: str, question: str) -> Optional[str]:
+        """Cached answer for a similar question about the same repo, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self.embeddings is None or not len(self.repos):
+                return None
+            query = self._embed(question)
+            # One vectorized matmul over all entries; other repos are masked out
+            sims = self.embeddings @ query
+            sims[np.array(self.repos) != repo] = -1.0
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                return self.answers[best]
+            return None
+
+    def add(self, repo: str, question: str, answer: str):
+        """Store an answer; the cache is persisted at most every SAVE_INTERVAL seconds"""
+        if not self.enabled or not answer.strip():
+            return
+        with self._lock:
+            vec = self._embed(question)[None, :]
+            if self.embeddings is None:
+                self.embeddings = vec
+            else:
+                self.embeddings = np.vstack([self.embeddings, vec])
+            self.repos.append(repo)
+            self.questions.append(question)
+            self.answers.append(answer)
+
+            # Drop the oldest entries past the cap
+            overflow = len(self.repos) - self.max_entries
+            if overflow > 0:
+                self.embeddings = self.embeddings[overflow:]
+                del self.repos[:overflow]
+                del self.questions[:overflow]
+                del self.answers[:overflow]
+            self._dirty = True
+            if time.monotonic() - self._last_save >= SAVE_INTERVAL:
+                self._save()
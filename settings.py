@@ -0,0 +1,35 @@
+# settings.py
+"""
+Configuration for AI Code Mate
+- Loads .env once; every other module imports its settings from here
+- See the README for what each variable does
+"""
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Groq model API
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
+# Set to 0 for models without native function calling; each step is then a non-streaming request
+# constrained to the agent_step JSON schema, which needs a Groq model with structured outputs
+# (e.g. openai/gpt-oss-20b or openai/gpt-oss-120b), not the default llama3-8b-8192
+GROQ_NATIVE_TOOLS = os.getenv("GROQ_NATIVE_TOOLS", "1") == "1"
+
+# GitHub
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GITHUB_OWNER = os.getenv("GITHUB_OWNER")
+GITHUB_REPO = os.getenv("GITHUB_REPO")
+
+# Semantic answer cache (optional)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", ".semantic_cache.npz")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+# Web UI
+# Earlier question/answer pairs sent to the agent as context
+MAX_TURNS = int(os.getenv("MAX_TURNS", "8"))
+# Chat requests are I/O-bound (Groq + GitHub), so several sessions can stream at once
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "8"))
@@ -0,0 +1,191 @@
+# transport.py
+"""
+Shared async HTTP transport for the Groq and GitHub APIs
+- One httpx.AsyncClient (HTTP/2, pooled keep-alive connections) for both services,
+  so concurrent tool calls and model requests multiplex over the same pool
+- Groq requests retry 429/5xx/network errors, honoring Retry-After
+- GitHub GETs (and GraphQL queries) retry transient 502/503/504s and return the response for the caller to inspect
+"""
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Union
+import httpx
+import orjson
+from tenacity import (
+    retry,
+    retry_if_exception,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_exponential,
+)
+
+GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GITHUB_API_URL = "https://api.github.com"
+
+# Retry policy for Groq API calls: 429 and 5xx responses plus network errors
+RETRY_ATTEMPTS = 6
+RETRY_BASE_SLEEP = 0.5
+RETRY_MAX_SLEEP = 30
+
+# Transient GitHub statuses worth retrying (GET only)
+GITHUB_RETRY_STATUSES = (502, 503, 504)
+
+
+def _is_retryable(exc):
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or 500 <= status < 600
+    return isinstance(exc, httpx.TransportError)
+
+
+def _retry_after_seconds(response):
+    """Parse Retry-After in either delta-seconds or HTTP-date form; None if absent/invalid"""
+    value = response.headers.get("Retry-After") or response.headers.get("X-RateLimit-Reset-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _wait_retry_after_or_jitter(retry_state):
+    """
+    Honor the server's Retry-After when it sent one; otherwise use decorrelated jitter:
+    sleep = uniform(base, previous_sleep * 3), capped.
+    """
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = _retry_after_seconds(exc.response)
+        if retry_after is not None:
+            return min(RETRY_MAX_SLEEP, retry_after)
+    # upcoming_sleep still holds the previous wait at this point (0 on the first retry)
+    prev = retry_state.upcoming_sleep or RETRY_BASE_SLEEP
+    return min(RETRY_MAX_SLEEP, random.uniform(RETRY_BASE_SLEEP, prev * 3))
+
+
+class Transport:
+    def __init__(self, groq_headers: Optional[Dict[str, str]] = None, github_base_url: str = GITHUB_API_URL):
+        self.groq_headers = groq_headers or {}
+        self.github_base_url = github_base_url
+        # An AsyncClient is bound to the event loop it first runs on, so it is
+        # recreated if a different loop picks it up (e.g. asyncio.run wrappers)
+        self._client = None
+        self._client_loop = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                timeout=httpx.Timeout(30, connect=5, read=300),
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        """Close the pooled client if it belongs to the running event loop"""
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+    @retry(
+        retry=retry_if_exception(_is_retryable),
+        wait=_wait_retry_after_or_jitter,
+        stop=stop_after_attempt(RETRY_ATTEMPTS),
+        reraise=True,
+    )
+    async def _groq_send(self, body: Union[bytes, Dict], stream: bool, timeout: float) -> httpx.Response:
+        """POST a chat completion request; body is a payload dict or an already serialized JSON body"""
+        if not isinstance(body, bytes):
+            body = orjson.dumps(body)
+        client = self.client
+        request = client.build_request(
+            "POST", GROQ_URL, content=body,
+            headers={**self.groq_headers, "Content-Type": "application/json"},
+            timeout=timeout,
+        )
+        r = await client.send(request, stream=stream)
+        if r.is_error:
+            if stream:
+                await r.aclose()
+            r.raise_for_status()
+        return r
+
+    async def groq_post(self, body: Union[bytes, Dict], timeout: float = 300) -> Dict:
+        """Non-streaming chat completion; returns the parsed JSON response"""
+        r = await self._groq_send(body, stream=False, timeout=timeout)
+        try:
+            return orjson.loads(r.content)
+        finally:
+            await r.aclose()
+
+    @asynccontextmanager
+    async def groq_stream(self, body: Union[bytes, Dict], timeout: float = 300):
+        """
+        Streaming chat completion: `async with transport.groq_stream(body) as r:`.
+        The connection goes back to the pool as soon as the block exits.
+        """
+        r = await self._groq_send(body, stream=True, timeout=timeout)
+        try:
+            yield r
+        finally:
+            await r.aclose()
+
+    @retry(
+        retry=retry_if_exception_type(httpx.TransportError)
+        | retry_if_result(lambda r: r.status_code in GITHUB_RETRY_STATUSES),
+        wait=wait_exponential(multiplier=0.5, max=4),
+        stop=stop_after_attempt(3),
+        # Out of attempts: hand back the last response (or raise the last network error)
+        retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+    )
+    async def github_get(self, path: str, params: Optional[Dict] = None,
+                         headers: Optional[Dict[str, str]] = None, timeout: float = 30) -> httpx.Response:
+        """GET a GitHub REST API path (e.g. "/repos/owner/name"); status handling is left to the caller"""
+        return await self.client.get(self.github_base_url + path, params=params, headers=headers, timeout=timeout)
+
+    @asynccontextmanager
+    async def github_stream(self, path: str, params: Optional[Dict] = None,
+                            headers: Optional[Dict[str, str]] = None, timeout: float = 60):
+        """
+        Streaming GET for large GitHub responses: `async with transport.github_stream(path) as r:`.
+        Not retried; the connection goes back to the pool when the block exits.
+        """
+        request = self.client.build_request(
+            "GET", self.github_base_url + path, params=params, headers=headers, timeout=timeout,
+        )
+        r = await self.client.send(request, stream=True)
+        try:
+            yield r
+        finally:
+            await r.aclose()
+
+    @retry(
+        retry=retry_if_exception_type(httpx.TransportError)
+        | retry_if_result(lambda r: r.status_code in GITHUB_RETRY_STATUSES),
+        wait=wait_exponential(multiplier=0.5, max=4),
+        stop=stop_after_attempt(3),
+        retry_error_callback=lambda retry_state: retry_state.outcome.result(),
+    )
+    async def github_post(self, path: str, body: Dict,
+                          headers: Optional[Dict[str, str]] = None, timeout: float = 30) -> httpx.Response:
+        """POST JSON to a GitHub API path; only for idempotent calls such as GraphQL queries"""
+        return await self.client.post(
+            self.github_base_url + path, content=orjson.dumps(body),
+            headers={**(headers or {}), "Content-Type": "application/json"}, timeout=timeout,
+        )